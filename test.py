@@ -1,27 +1,45 @@
 from watcher_log import FileWatcher
 import time
 import sys
+import threading
 from rich.progress import Progress, SpinnerColumn, TextColumn, BarColumn, TimeRemainingColumn
 
 # Get wait time from command line or use default
 wait_time = int(sys.argv[1]) if len(sys.argv) > 1 else 10
 
+
+class TimedProgress(Progress):
+    """Progress bar that advances itself from the clock on each auto-refresh."""
+
+    def __init__(self, *columns, started_at, **kwargs):
+        self.started_at = started_at
+        super().__init__(*columns, **kwargs)
+
+    def get_renderables(self):
+        elapsed = time.monotonic() - self.started_at
+        for task in self.tasks:
+            self.update(task.id, completed=min(elapsed, task.total))
+        yield from super().get_renderables()
+
+
 print(f"Starting file watcher for {wait_time} seconds...")
 print("Create, modify, or delete files in the current directory")
 
 with FileWatcher(".") as watcher:
-    with Progress(
+    with TimedProgress(
         SpinnerColumn(),
         TextColumn("[progress.description]{task.description}"),
         BarColumn(),
         TextColumn("[progress.percentage]{task.percentage:>3.0f}%"),
         TimeRemainingColumn(),
-        refresh_per_second=10
+        refresh_per_second=10,
+        started_at=time.monotonic(),
     ) as progress:
         task = progress.add_task("Watching files...", total=wait_time)
-        while not progress.finished:
-            progress.update(task, advance=0.1)
-            time.sleep(0.1)
+        # Block until the timeout (or Ctrl+C); the refresh thread draws the bar
+        done = threading.Event()
+        done.wait(timeout=wait_time)
+        progress.update(task, completed=wait_time)
 
 # Show final file lifetimes
 lifetimes = watcher.get_file_lifetimes()
@@ -30,4 +48,4 @@ if lifetimes:
     for path_info in lifetimes:
         print(path_info)
 else:
-    print("\nNo file changes detected.")
\ No newline at end of file
+    print("\nNo file changes detected.")
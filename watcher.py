@@ -1,58 +1,247 @@
+import json
+import os
+import re
 import sys
+import selectors
 import time
 import logging
+import operator
 import threading
+import weakref
+from collections import deque
 from datetime import datetime
 from pathlib import Path
-from watchdog.events import FileSystemEventHandler
+from watchdog.events import RegexMatchingEventHandler
 from watchdog.observers import Observer
 from rich.console import Console
 from rich.logging import RichHandler
+from rich.style import Style
 from rich.text import Text
 from rich.tree import Tree
 from rich.panel import Panel
+from watcher_log import (
+    EVENT_TYPES,
+    GIT_IGNORE_REGEX,
+    NO_EVENTS,
+    TYPE_CODE,
+    FileHistory,
+    TimestampFormatter,
+    _coalesce,
+    _trim,
+)
 
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the standard library
+    orjson = None
 
-class MyEventHandler(FileSystemEventHandler):
-    def __init__(self, console: Console, log_file: Path):
+
+# Debounce settings for writing events: a batch is flushed once no new event
+# has arrived for FLUSH_DELAY seconds, or FLUSH_MAX_DELAY after it was started.
+FLUSH_DELAY = 0.05
+FLUSH_MAX_DELAY = 0.5
+# How often buffered log data is pushed to disk while the watcher is idle
+LOG_SYNC_INTERVAL = 1.0
+
+# Console colour for each event type
+EVENT_STYLES = {"Created": "green", "Modified": "yellow", "Deleted": "red", "Moved": "blue"}
+# Parsed once so --pretty output doesn't resolve a style string per event
+EVENT_RICH_STYLES = {event_type: Style.parse(style) for event_type, style in EVENT_STYLES.items()}
+# The same colours as raw ANSI escapes, for printing without rich
+EVENT_ANSI = {"Created": "\x1b[32m", "Modified": "\x1b[33m", "Deleted": "\x1b[31m", "Moved": "\x1b[34m"}
+ANSI_RESET = "\x1b[0m"
+
+
+def _dumps(obj):
+    """Serialise obj as one JSON line, as bytes."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj) + b"\n"
+        except orjson.JSONEncodeError:
+            # e.g. a path that isn't valid UTF-8, held as surrogate escapes
+            pass
+    return json.dumps(obj, separators=(",", ":")).encode() + b"\n"
+
+
+def _iter_events(record):
+    """Yield (ts_ns, event_type, dest_path) for each event in a record."""
+    for ts_ns, code, dest_path in zip(record["ts"], record["type"], record["dest"]):
+        yield ts_ns, EVENT_TYPES[code], dest_path
+
+
+def _sync_log(log_fp, lock, closed):
+    """Periodically flush the log buffer so data reaches disk when idle."""
+    while not closed.wait(LOG_SYNC_INTERVAL):
+        with lock:
+            if not log_fp.closed:
+                log_fp.flush()
+
+
+def _close_log(log_fp, lock, closed):
+    """Stop the sync thread and close the log file."""
+    closed.set()
+    with lock:
+        log_fp.close()
+
+
+def _make_handler(event_type, coalesce=False, forget=False):
+    """Build the on_* callback for an event type that has a single path.
+
+    The label and style are fixed when the callback is built, so handling
+    an event only has to fill in the timestamp and path. With coalesce, an
+    event is dropped if the same path had one within the handler's
+    coalesce window. With forget, the path's coalesce state is discarded.
+    """
+    label = f" - File {event_type.lower()}: "
+    style = EVENT_RICH_STYLES[event_type]
+
+    def handler(self, event):
+        src_path = event.src_path
+        mono_ns = time.monotonic_ns()
+        if coalesce:
+            if mono_ns - self._last_mod_ns.get(src_path, 0) < self._coalesce_ns:
+                return
+            self._last_mod_ns[src_path] = mono_ns
+        elif forget:
+            self._last_mod_ns.pop(src_path, None)
+        ts_ns = time.time_ns()
+        self._log_event((mono_ns, ts_ns), event_type, src_path)
+        if self.pretty:
+            self.console.print(Text(self._fmt(ts_ns) + label + src_path, style=style))
+        else:
+            self._write_line(event_type, self._fmt(ts_ns) + label + src_path)
+
+    handler.__name__ = handler.__qualname__ = f"on_{event_type.lower()}"
+    return handler
+
+
+class MyEventHandler(RegexMatchingEventHandler):
+    def __init__(
+        self,
+        console: Console,
+        log_file: Path,
+        pretty: bool = False,
+        coalesce_ms: float = 50,
+        max_events_per_file: int = 1024,
+    ):
+        if max_events_per_file < 2:
+            raise ValueError(f"max_events_per_file must be at least 2, not {max_events_per_file!r}")
         self.console = console
+        self.pretty = pretty
+        # History kept per file; see _trim for how older events are dropped
+        self.max_events_per_file = max_events_per_file
+        # Modified events on a path within coalesce_ms of the last one are dropped
+        self._coalesce_ns = int(coalesce_ms * 1_000_000)
+        self._last_mod_ns = {}
+        # Only colour plain output when rich would colour it too
+        use_ansi = console.is_terminal and not console.no_color
+        self._ansi = {
+            event_type: code if use_ansi else "" for event_type, code in EVENT_ANSI.items()
+        }
+        self._ansi_reset = ANSI_RESET if use_ansi else ""
         self.log_file = log_file
-        self.file_history = {}
+        self.file_history = FileHistory()
         self.log_file.parent.mkdir(parents=True, exist_ok=True)
-        self.last_log_message = None
-        super().__init__()
+        # Keep one buffered handle open for the lifetime of the handler
+        self._log_fp = open(self.log_file, "ab", buffering=65536)
+        self._lock = threading.RLock()
+        self._closed = threading.Event()
+        # Neither the finalizer nor the sync thread refers to self, so the
+        # file is still closed if the handler is dropped without close()
+        self._finalizer = weakref.finalize(self, _close_log, self._log_fp, self._lock, self._closed)
+        self.last_logged_event = None
+        self._fmt = TimestampFormatter("%Y-%m-%d %H:%M:%S")
+        # Events are buffered and written in batches by a debounce timer
+        self._pending = deque()
+        self._flush_timer = None
+        self._last_event_at = 0.0
+        self._batch_deadline = 0.0
+        self._sync_thread = threading.Thread(
+            target=_sync_log, args=(self._log_fp, self._lock, self._closed), daemon=True
+        )
+        self._sync_thread.start()
+        # Directories, .git contents and our own log file are filtered out by
+        # RegexMatchingEventHandler.dispatch before any on_* method runs
+        log_file_regex = r"(?:\.[/\\])*" + re.escape(os.path.normpath(self.log_file)) + "$"
+        super().__init__(
+            ignore_regexes=[GIT_IGNORE_REGEX, log_file_regex],
+            ignore_directories=True,
+            case_sensitive=True,
+        )
 
-    def _log_event(self, event_type, file_path, dest_path=None):
-        current_time = datetime.now()
-        timestamp_str = current_time.strftime("%Y-%m-%d %H:%M:%S")
-        
-        if dest_path:
-            log_message = f"{timestamp_str} - {event_type}: {file_path} -> {dest_path}"
-        else:
-            log_message = f"{timestamp_str} - {event_type}: {file_path}"
+    def _log_event(self, stamp, event_type, file_path, dest_path=None):
+        """Queue an event timed by a (monotonic_ns, time_ns) stamp for the next flush."""
+        with self._lock:
+            self._pending.append((stamp, event_type, file_path, dest_path))
+            self._schedule_flush()
 
-        # Only log if message is different from last one
-        if log_message != self.last_log_message:
-            with open(self.log_file, "a") as f:
-                f.write(log_message + "\n")
-            
-            if file_path not in self.file_history:
-                self.file_history[file_path] = []
-            # Store the actual datetime object along with the event info
-            self.file_history[file_path].append((current_time, event_type, dest_path))
-            
-            self.last_log_message = log_message
+    def _schedule_flush(self):
+        """Arm the flush timer if this is the first event of a batch."""
+        self._last_event_at = time.monotonic()
+        if self._flush_timer is None:
+            self._batch_deadline = self._last_event_at + FLUSH_MAX_DELAY
+            self._start_flush_timer(FLUSH_DELAY)
+
+    def _start_flush_timer(self, delay):
+        self._flush_timer = threading.Timer(delay, self._on_flush_timer)
+        self._flush_timer.daemon = True
+        self._flush_timer.start()
+
+    def _on_flush_timer(self):
+        with self._lock:
+            # Wait for a quiet period, but never past the batch deadline
+            due = min(self._last_event_at + FLUSH_DELAY, self._batch_deadline)
+            remaining = due - time.monotonic()
+            if remaining > 0:
+                self._start_flush_timer(remaining)
+                return
+            self._flush()
 
-    def _calculate_lifetime(self, events):
+    def _flush(self):
+        """Write all pending events to the log file and the file history."""
+        with self._lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            batch = list(self._pending)
+            self._pending.clear()
+
+            lines = []
+            for file_path, events in _coalesce(batch):
+                record = self.file_history[file_path]
+                for (mono_ns, ts_ns), event_type, dest_path in events:
+                    # Only log if the event differs from the last one within a second
+                    log_key = (ts_ns // 1_000_000_000, event_type, file_path, dest_path)
+                    if log_key == self.last_logged_event:
+                        continue
+                    lines.append(_dumps({"ts": ts_ns, "ev": event_type, "src": file_path, "dst": dest_path}))
+
+                    # Store raw timestamps: monotonic for durations, wall clock for display
+                    record["mono"].append(mono_ns)
+                    record["ts"].append(ts_ns)
+                    record["type"].append(TYPE_CODE[event_type])
+                    record["dest"].append(dest_path)
+                    _trim(record, self.max_events_per_file)
+
+                    self.last_logged_event = log_key
+
+            if lines and not self._log_fp.closed:
+                self._log_fp.write(b"".join(lines))
+
+    def close(self):
+        """Write out pending events and close the log file."""
+        self._flush()
+        self._finalizer()
+
+    def _calculate_lifetime(self, record):
         """Calculate the lifetime of a file based on its events."""
-        if not events:
+        if not record["ts"]:
             return "N/A"
         
-        first_event = events[0][0]  # First event timestamp
-        last_event = events[-1][0]  # Use last event time
+        first_event = record["mono"][0]  # First event timestamp
+        last_event = record["mono"][-1]  # Use last event time
         
-        lifetime = last_event - first_event
-        seconds = lifetime.total_seconds()
+        seconds = (last_event - first_event) / 1e9
         
         if seconds < 60:
             return f"{seconds:.1f} seconds"
@@ -63,50 +252,54 @@ class MyEventHandler(FileSystemEventHandler):
 
     def _print_tree(self):
         """Print the tree in the log file and console at the end."""
-        # First write a summary to the log file
-        with open(self.log_file, "a") as f:
-            f.write("\n=== File History Summary ===\n")
-            
-            # Sort files by creation time
-            sorted_files = sorted(self.file_history.items(), 
-                                key=lambda x: x[1][0][0] if x[1] else datetime.max)
-            
-            for path, events in sorted_files:
-                if not events:
-                    continue
-                    
-                lifetime = self._calculate_lifetime(events)
-                creation_time = events[0][0].strftime("%Y-%m-%d %H:%M:%S")
-                
-                # Write to log file
-                f.write(f"\nFile: {path}\n")
-                f.write(f"Created: {creation_time}\n")
-                f.write(f"Lifetime: {lifetime}\n")
-                f.write("Events:\n")
-                
-                for time, event_type, dest_path in events:
-                    time_str = time.strftime("%Y-%m-%d %H:%M:%S")
-                    if dest_path:
-                        f.write(f"  {time_str} - {event_type} -> {dest_path}\n")
-                    else:
-                        f.write(f"  {time_str} - {event_type}\n")
-                f.write("\n")  # Add extra newline between files
+        self._flush()
+
+        # Sort files by creation time
+        sorted_files = [
+            (record["mono"][0] if record["mono"] else NO_EVENTS, path, record)
+            for path, record in self.file_history.items()
+        ]
+        sorted_files.sort(key=operator.itemgetter(0))
+
+        # First append one summary record per file to the log, written at once
+        lines = []
+        for _, path, record in sorted_files:
+            if not record["ts"]:
+                continue
+
+            summary = {
+                "file": path,
+                "created": record["ts"][0],
+                "lifetime": self._calculate_lifetime(record),
+                "dropped": record["dropped"],
+                "events": [
+                    {"ts": time, "ev": event_type, "dst": dest_path}
+                    for time, event_type, dest_path in _iter_events(record)
+                ],
+            }
+            lines.append(_dumps({"summary": summary}))
+
+        with self._lock:
+            self._log_fp.write(b"".join(lines))
+            self._log_fp.flush()
 
         # Now print to console with rich formatting
-        for path, events in sorted_files:
-            if not events:
+        for _, path, record in sorted_files:
+            if not record["ts"]:
                 continue
                 
             tree = Tree(f"[bold]File: {path}[/bold]")
-            lifetime = self._calculate_lifetime(events)
-            creation_time = events[0][0].strftime("%Y-%m-%d %H:%M:%S")
+            lifetime = self._calculate_lifetime(record)
+            creation_time = self._fmt(record["ts"][0])
             
             tree.add(f"[blue]Created: {creation_time}[/blue]")
             tree.add(f"[green]Lifetime: {lifetime}[/green]")
             
+            if record["dropped"]:
+                tree.add(f"[dim]{record['dropped']} older events not kept[/dim]")
             events_branch = tree.add("Events:")
-            for time, event_type, dest_path in events:
-                time_str = time.strftime("%Y-%m-%d %H:%M:%S")
+            for time, event_type, dest_path in _iter_events(record):
+                time_str = self._fmt(time)
                 if dest_path:
                     events_branch.add(f"[yellow]{time_str} - {event_type} -> {dest_path}[/yellow]")
                 else:
@@ -115,43 +308,24 @@ class MyEventHandler(FileSystemEventHandler):
             self.console.print(Panel(tree))
             self.console.print()  # Add extra newline between files
 
-    def on_created(self, event):
-        if not event.is_directory and self._is_event_relevant(event.src_path):
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            self._log_event("Created", event.src_path)
-            self.console.print(Text(f"{timestamp} - File created: {event.src_path}", style="green"))
-
-    def on_modified(self, event):
-        if not event.is_directory and self._is_event_relevant(event.src_path):
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            self._log_event("Modified", event.src_path)
-            self.console.print(Text(f"{timestamp} - File modified: {event.src_path}", style="yellow"))
-
-    def on_deleted(self, event):
-        if not event.is_directory and self._is_event_relevant(event.src_path):
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            self._log_event("Deleted", event.src_path)
-            self.console.print(Text(f"{timestamp} - File deleted: {event.src_path}", style="red"))
+    on_created = _make_handler("Created")
+    # Only modifications are coalesced; the other events change the file's structure
+    on_modified = _make_handler("Modified", coalesce=True)
+    on_deleted = _make_handler("Deleted", forget=True)
 
     def on_moved(self, event):
-        if (
-            not event.is_directory
-            and self._is_event_relevant(event.src_path)
-            and self._is_event_relevant(event.dest_path)
-        ):
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            self._log_event("Moved", event.src_path, event.dest_path)
-            self.console.print(
-                Text(
-                    f"{timestamp} - File moved from {event.src_path} to {event.dest_path}",
-                    style="blue",
-                )
-            )
-
-    def _is_event_relevant(self, file_path):
-        """Checks if the event is relevant (not the log file or .git files)."""
-        path = Path(file_path)
-        return path != self.log_file and ".git" not in path.parts
+        self._last_mod_ns.pop(event.src_path, None)
+        ts_ns = time.time_ns()
+        self._log_event((time.monotonic_ns(), ts_ns), "Moved", event.src_path, event.dest_path)
+        line = f"{self._fmt(ts_ns)} - File moved from {event.src_path} to {event.dest_path}"
+        if self.pretty:
+            self.console.print(Text(line, style=EVENT_RICH_STYLES["Moved"]))
+        else:
+            self._write_line("Moved", line)
+
+    def _write_line(self, event_type, line):
+        """Print an event line with a plain ANSI colour, bypassing rich."""
+        self.console.file.write(f"{self._ansi[event_type]}{line}{self._ansi_reset}\n")
 
 
 class WatcherState:
@@ -168,31 +342,53 @@ if __name__ == "__main__":
         handlers=[RichHandler(console=console, rich_tracebacks=True)],
     )
 
-    path = sys.argv[1] if len(sys.argv) > 1 else "."
+    # --pretty renders event lines through rich instead of plain ANSI output
+    args = sys.argv[1:]
+    pretty = "--pretty" in args
+    args = [arg for arg in args if arg != "--pretty"]
+    path = args[0] if args else "."
     log_dir = Path("./logs")
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    log_file = log_dir / f"watcher_{timestamp}.log"
+    log_file = log_dir / f"watcher_{timestamp}.jsonl"
 
-    event_handler = MyEventHandler(console, log_file)
+    event_handler = MyEventHandler(console, log_file, pretty=pretty)
     observer = Observer()
     observer.schedule(event_handler, path, recursive=True)
     observer.start()
 
     state = WatcherState()
 
-    def check_user_input():
-        while state.running:
-            user_input = input()
-            if user_input.strip() == ":q":
-                state.running = False
-                break
-
-    input_thread = threading.Thread(target=check_user_input, daemon=True)
-    input_thread.start()
+    # Wait for ":q" on stdin in the main thread instead of a reader thread
+    sel = selectors.DefaultSelector()
+    try:
+        sel.register(sys.stdin, selectors.EVENT_READ)
+        sel.select(timeout=0)
+    except (OSError, ValueError):
+        # stdin can't be polled here (e.g. a Windows console or a plain file)
+        sel.close()
+        sel = None
+        logging.warning("Not reading commands from stdin; press Ctrl+C to stop.")
 
+    # Read stdin unbuffered: a buffered readline() could pull several lines
+    # into its buffer, and select() would not report the ones left there
+    pending_input = b""
     try:
         while state.running:
-            time.sleep(0.1)
+            if sel is None:
+                time.sleep(1.0)
+                continue
+            for key, _ in sel.select(timeout=1.0):
+                data = os.read(sys.stdin.fileno(), 4096)
+                if not data:
+                    # stdin was closed: keep watching until Ctrl+C
+                    sel.close()
+                    sel = None
+                    lines = [pending_input]
+                else:
+                    # Keep an incomplete last line for the next read
+                    *lines, pending_input = (pending_input + data).split(b"\n")
+                if any(line.strip() == b":q" for line in lines):
+                    state.running = False
     except KeyboardInterrupt:
         state.running = False
         console.print("[bold magenta]Watcher stopped by user.[/bold magenta]")
@@ -200,4 +396,5 @@ if __name__ == "__main__":
         observer.stop()
         observer.join()
         event_handler._print_tree()
+        event_handler.close()
         console.print("[bold magenta]Watcher finished.[/bold magenta]")
@@ -1,36 +1,288 @@
+import contextlib
+import logging
+import multiprocessing
+import operator
+import os
+import queue
+import re
+import signal
 import sys
 import time
 import threading
+from array import array
 from datetime import datetime
-from pathlib import Path
-from watchdog.events import FileSystemEventHandler
+from watchdog.events import RegexMatchingEventHandler
 from watchdog.observers import Observer
+from watchdog.observers.api import ObservedWatch
+from watchdog.observers.polling import PollingObserver
 from rich.console import Console
 from rich.text import Text
 from rich.panel import Panel
 
 
+# Sort key for files without any recorded event
+NO_EVENTS = sys.maxsize
+# Matches any path that is, or is inside, a .git directory
+GIT_IGNORE_REGEX = r"(?:.*[/\\])?\.git(?:[/\\].*)?$"
+# Observer types accepted by FileWatcher
+OBSERVER_TYPES = ("auto", "native", "polling")
+# Network and VM-shared filesystems where native notifications miss changes
+REMOTE_FS_TYPES = {
+    "nfs", "nfs4", "cifs", "smb3", "smbfs", "9p", "drvfs", "v9fs",
+    "fuse.sshfs", "afs", "ceph", "glusterfs", "lustre", "vboxsf",
+}
+# Pseudo filesystems that never report changes through inotify
+NO_NOTIFY_FS_TYPES = {"proc", "sysfs", "debugfs", "tracefs", "securityfs", "configfs"}
+# Batches a worker process may queue up before it blocks, and how many of
+# them the parent records in one go
+WORKER_QUEUE_SIZE = 1024
+WORKER_DRAIN_MAX = 128
+# Workers are always spawned: a forked child would inherit the entries in
+# _SHARED_OBSERVERS, whose observer threads don't exist in the child, and
+# possibly a _SHARED_LOCK held by another thread at fork time
+_WORKER_CONTEXT = multiprocessing.get_context("spawn")
+
+# Running observers shared by all FileWatcher instances, keyed by observer
+# kind. Each entry is [observer, number of FileWatchers using it, and a
+# dict of watch -> number of handlers scheduled on it]. Watchers of the
+# same path share one ObservedWatch, so it is only unscheduled once the
+# last of their handlers is removed.
+_SHARED_OBSERVERS = {}
+_SHARED_LOCK = threading.Lock()
+
+
+# Event types are stored in file_history as one-byte codes
+EVENT_TYPES = ("Created", "Modified", "Deleted", "Moved")
+TYPE_CODE = {event_type: code for code, event_type in enumerate(EVENT_TYPES)}
+
+
+def _new_record():
+    """Return an empty file_history record with one column per event field."""
+    return {"mono": array("q"), "ts": array("q"), "type": bytearray(), "dest": [], "dropped": 0}
+
+
+def _trim(record, max_events):
+    """Bound a record's memory once it holds twice max_events events.
+
+    The oldest events are dropped down to max_events, except the first one,
+    which stays at index 0 so creation time and lifetime remain correct.
+    max_events must be at least 2 so the latest event is kept too.
+    Trimming in chunks keeps the cost of each append constant on average.
+    """
+    excess = len(record["ts"]) - max_events
+    if excess < max_events:
+        return
+    for column in ("mono", "ts", "type", "dest"):
+        del record[column][1:excess + 1]
+    record["dropped"] += excess
+
+
+class TimestampFormatter:
+    """Format time.time_ns() timestamps with strftime, reusing the string within a second."""
+
+    def __init__(self, fmt):
+        self.fmt = fmt
+        self._cache = (None, "")
+
+    def __call__(self, ts_ns):
+        sec = ts_ns // 1_000_000_000
+        cached_sec, cached_str = self._cache
+        if sec == cached_sec:
+            return cached_str
+        time_str = datetime.fromtimestamp(sec).strftime(self.fmt)
+        self._cache = (sec, time_str)
+        return time_str
+
+
+class FileHistory(dict):
+    """Map of path -> record that creates a record on first access.
+
+    Works like defaultdict(_new_record), but interns the path when its record
+    is created so repeated events share one key string.
+    """
+
+    def __missing__(self, file_path):
+        record = self[sys.intern(file_path)] = _new_record()
+        return record
+
+
+def _detect_fs_type(path):
+    """Return the type of the filesystem holding path, or None if unknown.
+
+    Reads /proc/self/mountinfo, so this only gives an answer on Linux.
+    """
+    try:
+        with open("/proc/self/mountinfo") as f:
+            mounts = f.read().splitlines()
+    except OSError:
+        return None
+
+    path = os.path.realpath(path)
+    best_mount, fs_type = "", None
+    for line in mounts:
+        fields = line.split()
+        # Field 5 is the mount point; the fs type follows the "-" separator
+        mount_point = re.sub(r"\\([0-7]{3})", lambda m: chr(int(m.group(1), 8)), fields[4])
+        prefix = mount_point.rstrip("/") + "/"
+        if path != mount_point and not path.startswith(prefix):
+            continue
+        if len(mount_point) >= len(best_mount):
+            best_mount = mount_point
+            fs_type = fields[fields.index("-", 6) + 1]
+    return fs_type
+
+
+def _acquire_observer(key, factory):
+    """Return the shared observer for key, creating and starting it if needed."""
+    with _SHARED_LOCK:
+        entry = _SHARED_OBSERVERS.get(key)
+        if entry is None:
+            observer = factory()
+            observer.start()
+            entry = _SHARED_OBSERVERS[key] = [observer, 0, {}]
+        entry[1] += 1
+        return entry[0]
+
+
+def _release_observer(key):
+    """Drop one user of a shared observer, stopping it when none are left."""
+    with _SHARED_LOCK:
+        entry = _SHARED_OBSERVERS[key]
+        entry[1] -= 1
+        if entry[1]:
+            return
+        del _SHARED_OBSERVERS[key]
+    entry[0].stop()
+    entry[0].join()
+
+
+def _add_handler(key, handler, path):
+    """Schedule handler on path with the shared observer for key; return the watch."""
+    with _SHARED_LOCK:
+        observer, _, handlers = _SHARED_OBSERVERS[key]
+        try:
+            watch = observer.schedule(handler, path, recursive=True)
+        except BaseException:
+            # schedule() registers the handler before starting the emitter
+            with contextlib.suppress(KeyError):
+                observer.remove_handler_for_watch(handler, ObservedWatch(path, recursive=True))
+            raise
+        handlers[watch] = handlers.get(watch, 0) + 1
+        return watch
+
+
+def _remove_handler(key, handler, watch):
+    """Remove a handler added by _add_handler, unscheduling the watch when it was the last."""
+    with _SHARED_LOCK:
+        observer, _, handlers = _SHARED_OBSERVERS[key]
+        handlers[watch] -= 1
+        if handlers[watch]:
+            observer.remove_handler_for_watch(handler, watch)
+            return
+        del handlers[watch]
+        observer.unschedule(watch)
+
+
+def _coalesce(batch):
+    """Group a batch of events by path and squash runs of identical events.
+
+    Each run of the same event type on a path is reduced to its earliest and
+    latest occurrence. Events are timed by (monotonic_ns, time_ns) stamps.
+    Yields (path, [(stamp, event_type, dest_path), ...]).
+    """
+    by_path = {}
+    for stamp, event_type, file_path, dest_path in batch:
+        runs = by_path.setdefault(file_path, [])
+        if runs and runs[-1][1] == event_type and runs[-1][2] == dest_path:
+            runs[-1][3] = stamp
+        else:
+            runs.append([stamp, event_type, dest_path, None])
+
+    for file_path, runs in by_path.items():
+        events = []
+        for first_time, event_type, dest_path, last_time in runs:
+            events.append((first_time, event_type, dest_path))
+            if last_time is not None:
+                events.append((last_time, event_type, dest_path))
+        yield file_path, events
+
+
 class FileWatcher:
-    def __init__(self, watch_path="."):
+    def __init__(self, watch_path=".", on_batch=None, batch_window=0.1, batch_max_delay=0.5,
+                 observer="auto", poll_interval=30.0, coalesce_ms=50, process=False,
+                 max_events_per_file=1024):
+        """Create a watcher for watch_path.
+
+        Events are collected into batches: a batch is recorded once no new
+        event has arrived for batch_window seconds, or batch_max_delay seconds
+        after its first event. If given, on_batch is called with each recorded
+        batch as a list of (ts_ns, event_type, src_path, dest_path) tuples,
+        where ts_ns is a time.time_ns() timestamp.
+
+        observer selects how changes are detected: "native" uses the
+        platform's notification API (inotify on Linux), "polling" rescans the
+        tree every poll_interval seconds, and "auto" polls only when
+        watch_path is on a network or otherwise unsupported filesystem.
+
+        A Modified event is dropped if the same path was last modified less
+        than coalesce_ms milliseconds earlier.
+
+        file_history keeps roughly the latest max_events_per_file events of
+        each file, plus its first event; max_events_per_file must be at
+        least 2.
+
+        With process=True the observer and event handling run in a separate
+        worker process, which sends coalesced batches back over a queue.
+        This keeps event handling from competing with the caller for the GIL.
+        The worker is started with the "spawn" method, so the calling
+        script's main module must be import-safe (guarded by
+        if __name__ == "__main__").
+        """
+        if observer not in OBSERVER_TYPES:
+            raise ValueError(f"observer must be one of {OBSERVER_TYPES}, not {observer!r}")
+        if max_events_per_file < 2:
+            # Trimming keeps the first event, so one more is needed for the latest
+            raise ValueError(f"max_events_per_file must be at least 2, not {max_events_per_file!r}")
         self.console = Console()
         self.watch_path = watch_path
-        self.file_history = {}
+        self.file_history = FileHistory()
         self.running = False
         self.observer = None
+        self.observer_type = observer
+        self.poll_interval = poll_interval
+        self.coalesce_ms = coalesce_ms
+        self.max_events_per_file = max_events_per_file
+        self.process = process
+        self._worker = None
+        self._worker_queue = None
+        self._worker_stop = None
+        self._drainer = None
+        self._observer_key = None
+        self._watch = None
+        self._handler = None
+        self.on_batch = on_batch
+        self.batch_window = batch_window
+        self.batch_max_delay = batch_max_delay
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        self._pending_ready = threading.Condition(self._pending_lock)
+        self._history_lock = threading.Lock()
+        self._flusher = None
+        self._stopping = False
+        self._fmt = TimestampFormatter("%H:%M:%S")
 
-    def _calculate_lifetime(self, events):
+    def _calculate_lifetime(self, record):
         """Calculate the lifetime of a file based on its events."""
-        if not events:
+        if not record["mono"]:
             return "N/A"
         
-        first_event = events[0][0]  # First event timestamp
-        if events[-1][1] == "Deleted":
-            last_event = events[-1][0]  # Use deletion time
-            lifetime = last_event - first_event
+        first_event = record["mono"][0]  # First event timestamp
+        if record["type"][-1] == TYPE_CODE["Deleted"]:
+            last_event = record["mono"][-1]  # Use deletion time
         else:
-            lifetime = datetime.now() - first_event
+            last_event = time.monotonic_ns()
         
-        seconds = lifetime.total_seconds()
+        seconds = (last_event - first_event) / 1e9
         if seconds < 60:
             return f"{seconds:.1f}s"
         elif seconds < 3600:
@@ -39,39 +291,104 @@ class FileWatcher:
             return f"{seconds/3600:.1f}h"
 
     def _log_event(self, event_type, file_path, dest_path=None):
-        current_time = datetime.now()
-        
-        if file_path not in self.file_history:
-            self.file_history[file_path] = []
-        self.file_history[file_path].append((current_time, event_type, dest_path))
+        """Queue an event; it is recorded with the next batch."""
+        stamp = (time.monotonic_ns(), time.time_ns())
+        with self._pending_lock:
+            self._pending.append((stamp, event_type, file_path, dest_path))
+            if len(self._pending) == 1:
+                self._pending_ready.notify()
 
-    def _is_event_relevant(self, file_path):
-        """Checks if the event is relevant (not .git files)."""
-        path = Path(file_path)
-        return ".git" not in path.parts
+    def _log_event_batch(self, batch):
+        """Coalesce a batch of queued events and record it."""
+        return self._record_events(list(_coalesce(batch)))
+
+    def _record_events(self, groups):
+        """Add coalesced (path, events) groups to the file history.
+
+        Must be called with _history_lock held. Returns the recorded events
+        as (ts_ns, event_type, src_path, dest_path) tuples.
+        """
+        recorded = []
+        for file_path, events in groups:
+            record = self.file_history[file_path]
+            record["mono"].extend([mono_ns for (mono_ns, _), _, _ in events])
+            record["ts"].extend([ts_ns for (_, ts_ns), _, _ in events])
+            record["type"].extend([TYPE_CODE[event_type] for _, event_type, _ in events])
+            record["dest"].extend([dest_path for _, _, dest_path in events])
+            _trim(record, self.max_events_per_file)
+            recorded.extend((ts_ns, event_type, file_path, dest_path)
+                            for (_, ts_ns), event_type, dest_path in events)
+        return recorded
+
+    def _notify_batch(self, recorded):
+        """Pass recorded events to on_batch; called without any lock held."""
+        if self.on_batch is None or not recorded:
+            return
+        try:
+            self.on_batch(recorded)
+        except Exception:
+            # A failing callback must not stop the flusher or drainer thread
+            logging.exception("on_batch callback failed")
+
+    def _flush(self):
+        """Record all pending events now."""
+        with self._history_lock:
+            with self._pending_lock:
+                batch, self._pending = self._pending, []
+            recorded = self._log_event_batch(batch) if batch else None
+        self._notify_batch(recorded)
+
+    def _run_flusher(self):
+        """Wait for events and record them in batches until stopped."""
+        while True:
+            with self._pending_ready:
+                while not self._pending and not self._stopping:
+                    self._pending_ready.wait()
+                if self._stopping:
+                    break
+
+                # Keep collecting until a window passes without new events
+                deadline = time.monotonic() + self.batch_max_delay
+                while not self._stopping:
+                    seen = len(self._pending)
+                    timeout = min(self.batch_window, deadline - time.monotonic())
+                    if timeout <= 0:
+                        break
+                    self._pending_ready.wait(timeout)
+                    if len(self._pending) == seen:
+                        break
+            self._flush()
+        self._flush()
 
     def get_file_lifetimes(self):
         """Return a list of files and their lifetimes in order of creation."""
-        sorted_files = sorted(self.file_history.items(), 
-                            key=lambda x: x[1][0][0] if x[1] else datetime.max)
+        self._flush()
+        with self._history_lock:
+            return self._format_lifetimes()
+
+    def _format_lifetimes(self):
+        """Build the get_file_lifetimes() lines; needs _history_lock held."""
+        sorted_files = [
+            (record["mono"][0] if record["mono"] else NO_EVENTS, path, record)
+            for path, record in self.file_history.items()
+        ]
+        sorted_files.sort(key=operator.itemgetter(0))
         
         lifetimes = []
-        for path, events in sorted_files:
-            if not events:
+        for _, path, record in sorted_files:
+            if not record["ts"]:
                 continue
                 
             # Get creation time (first event)
-            creation_time = events[0][0]
-            creation_str = creation_time.strftime("%H:%M:%S")
+            creation_time = record["ts"][0]
+            creation_str = self._fmt(creation_time)
             
             # Get last event time
-            last_event = events[-1]
-            last_time = last_event[0]  # Default to last event time
-            last_str = last_time.strftime("%H:%M:%S")
+            last_time = record["ts"][-1]
+            last_str = self._fmt(last_time)
             
-            # Calculate time difference
-            time_diff = last_time - creation_time
-            seconds = time_diff.total_seconds()
+            # Calculate time difference on the monotonic clock
+            seconds = (record["mono"][-1] - record["mono"][0]) / 1e9
             
             # Format time difference
             if seconds < 60:
@@ -87,38 +404,155 @@ class FileWatcher:
             
         return lifetimes
 
+    def _observer_spec(self):
+        """Return (key, factory) for the observer that should watch watch_path."""
+        fs_type = _detect_fs_type(self.watch_path)
+        observer_type = self.observer_type
+        if observer_type == "auto":
+            if fs_type in REMOTE_FS_TYPES or fs_type in NO_NOTIFY_FS_TYPES:
+                observer_type = "polling"
+            else:
+                observer_type = "native"
+        elif observer_type == "native" and fs_type in NO_NOTIFY_FS_TYPES:
+            raise ValueError(
+                f"{self.watch_path} is on {fs_type}, which does not report changes; "
+                "use observer='polling'"
+            )
+
+        if observer_type == "polling":
+            return ("polling", self.poll_interval), lambda: PollingObserver(timeout=self.poll_interval)
+        return ("native",), Observer
+
+    def _drain_worker(self):
+        """Record batches sent by the worker process until it finishes."""
+        while True:
+            try:
+                groups = self._worker_queue.get(timeout=1.0)
+            except queue.Empty:
+                if not self._worker.is_alive():
+                    return
+                continue
+
+            # Take whatever else is already waiting and record it together
+            batches = [groups]
+            while groups is not None and len(batches) < WORKER_DRAIN_MAX:
+                try:
+                    groups = self._worker_queue.get_nowait()
+                except queue.Empty:
+                    break
+                batches.append(groups)
+
+            recorded = []
+            with self._history_lock:
+                for groups in batches:
+                    if groups is None:
+                        break
+                    recorded.extend(self._record_events(groups))
+            self._notify_batch(recorded)
+            if groups is None:
+                return
+
+    def _start_worker(self):
+        """Run the observer in a worker process instead of this one."""
+        options = {
+            "batch_window": self.batch_window,
+            "batch_max_delay": self.batch_max_delay,
+            "observer": self.observer_type,
+            "poll_interval": self.poll_interval,
+            "coalesce_ms": self.coalesce_ms,
+        }
+        self._worker_queue = _WORKER_CONTEXT.Queue(WORKER_QUEUE_SIZE)
+        self._worker_stop = _WORKER_CONTEXT.Event()
+        self._worker = _WORKER_CONTEXT.Process(
+            target=_run_worker,
+            args=(self._worker_queue, self._worker_stop, self.watch_path, options),
+            daemon=True,
+        )
+        self._worker.start()
+
+        # The worker reports whether its watcher started before sending events
+        while True:
+            try:
+                status, error = self._worker_queue.get(timeout=1.0)
+                break
+            except queue.Empty:
+                if not self._worker.is_alive():
+                    status, error = "error", RuntimeError(
+                        f"worker process exited with code {self._worker.exitcode}"
+                    )
+                    break
+        if status != "ready":
+            self._worker.join()
+            self._worker_queue.close()
+            self._worker = self._worker_queue = self._worker_stop = None
+            raise error
+
+        self._drainer = threading.Thread(target=self._drain_worker, daemon=True)
+        self._drainer.start()
+
+    def _stop_worker(self):
+        self._worker_stop.set()
+        self._drainer.join()
+        self._worker.join()
+        self._worker_queue.close()
+        self._worker = self._worker_queue = self._worker_stop = self._drainer = None
+
     def start(self):
         """Start watching files."""
         if self.running:
             return
 
-        class EventHandler(FileSystemEventHandler):
+        key, factory = self._observer_spec()
+        if self.process:
+            self._start_worker()
+            self.running = True
+            return
+
+        class EventHandler(RegexMatchingEventHandler):
             def __init__(self, parent):
                 self.parent = parent
-                super().__init__()
+                self._coalesce_ns = int(parent.coalesce_ms * 1_000_000)
+                self._last_mod_ns = {}
+                # Directories and .git contents never reach the on_* methods
+                super().__init__(
+                    ignore_regexes=[GIT_IGNORE_REGEX],
+                    ignore_directories=True,
+                    case_sensitive=True,
+                )
 
             def on_created(self, event):
-                if not event.is_directory and self.parent._is_event_relevant(event.src_path):
-                    self.parent._log_event("Created", event.src_path)
+                self.parent._log_event("Created", event.src_path)
 
             def on_modified(self, event):
-                if not event.is_directory and self.parent._is_event_relevant(event.src_path):
-                    self.parent._log_event("Modified", event.src_path)
+                # Drop repeats of a write burst; structural events are never coalesced
+                now = time.monotonic_ns()
+                if now - self._last_mod_ns.get(event.src_path, 0) < self._coalesce_ns:
+                    return
+                self._last_mod_ns[event.src_path] = now
+                self.parent._log_event("Modified", event.src_path)
 
             def on_deleted(self, event):
-                if not event.is_directory and self.parent._is_event_relevant(event.src_path):
-                    self.parent._log_event("Deleted", event.src_path)
+                self._last_mod_ns.pop(event.src_path, None)
+                self.parent._log_event("Deleted", event.src_path)
 
             def on_moved(self, event):
-                if (not event.is_directory and 
-                    self.parent._is_event_relevant(event.src_path) and 
-                    self.parent._is_event_relevant(event.dest_path)):
-                    self.parent._log_event("Moved", event.src_path, event.dest_path)
+                self._last_mod_ns.pop(event.src_path, None)
+                self.parent._log_event("Moved", event.src_path, event.dest_path)
 
+        self._handler = EventHandler(self)
+        self.observer = _acquire_observer(key, factory)
+        try:
+            self._watch = _add_handler(key, self._handler, self.watch_path)
+        except BaseException:
+            _release_observer(key)
+            self.observer = self._handler = None
+            raise
+        self._observer_key = key
         self.running = True
-        self.observer = Observer()
-        self.observer.schedule(EventHandler(self), self.watch_path, recursive=True)
-        self.observer.start()
+
+        self._stopping = False
+        self._flusher = threading.Thread(target=self._run_flusher, daemon=True)
+        self._flusher.start()
 
     def stop(self):
         """Stop watching files."""
@@ -126,9 +560,20 @@ class FileWatcher:
             return
             
         self.running = False
+        if self._worker:
+            self._stop_worker()
+            return
         if self.observer:
-            self.observer.stop()
-            self.observer.join()
+            # Other watchers may still be using the observer
+            _remove_handler(self._observer_key, self._handler, self._watch)
+            _release_observer(self._observer_key)
+            self.observer = None
+            self._watch = self._handler = None
+
+        with self._pending_ready:
+            self._stopping = True
+            self._pending_ready.notify()
+        self._flusher.join()
 
     def __enter__(self):
         """Context manager entry."""
@@ -140,6 +585,39 @@ class FileWatcher:
         self.stop()
 
 
+class _ForwardingWatcher(FileWatcher):
+    """FileWatcher used inside a worker process.
+
+    Instead of recording batches itself it forwards them to the parent.
+    """
+
+    def __init__(self, out_queue, watch_path, **options):
+        super().__init__(watch_path, **options)
+        self._out_queue = out_queue
+
+    def _record_events(self, groups):
+        self._out_queue.put(groups)
+        return []
+
+
+def _run_worker(out_queue, stop, watch_path, options):
+    """Entry point of the worker process started by FileWatcher(process=True)."""
+    # Ctrl+C is handled by the parent, which shuts the worker down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        watcher = _ForwardingWatcher(out_queue, watch_path, **options)
+        watcher.start()
+    except Exception as exc:
+        out_queue.put(("error", exc))
+        return
+    out_queue.put(("ready", None))
+    try:
+        stop.wait()
+    finally:
+        watcher.stop()
+        out_queue.put(None)
+
+
 if __name__ == "__main__":
     # Example usage
     with FileWatcher() as watcher: